@@ -1,18 +1,51 @@
 # app.py
-from flask import Flask, request, render_template_string, send_file
+from flask import Flask, request, render_template_string, send_file, abort, jsonify
 import os
+import logging
 import zipfile
 import shutil
-import tempfile
-import pandas as pd
 
 # On importe tes fonctions déjà présentes dans main.py
 from main import init_paths, load_department_mapping, generate_fiches, generate_courriers, merge_docx_per_commune, get_date_today
+from main import is_flag_set, add_directory_to_zip, run_streaming_pipeline
+from utils.upload import (
+    ALLOWED_EXTENSIONS, UploadError, UploadRequest,
+    detect_extension, get_max_upload_bytes, read_uploaded_table
+)
+from utils.workspace import WorkspaceManager, WorkspaceQuotaExceeded
+from utils.http_client import HttpClient, get_job_deadline_seconds
+from utils.warmup import warm_up, status as warmup_status
+from utils.profiling import PipelineProfiler, REPORT_NAME
+from utils.duplicates import DEDUP_MODES, deduplicate_dispositifs, get_dedup_settings, REPORT_NAME as DEDUP_REPORT_NAME
 
 # --------------------------------------------------------
 # 1. Initialiser l'application Flask
 # --------------------------------------------------------
 app = Flask(__name__)
+# Les fichiers reçus sont écrits directement dans le dossier du traitement
+app.request_class = UploadRequest
+# Taille maximale d'une requête (variable d'environnement UPLOAD_MAX_BYTES, 1 Go par défaut,
+# 0 = aucune limite) : werkzeug répond 413 dès que le corps la dépasse
+app.config['MAX_CONTENT_LENGTH'] = get_max_upload_bytes()
+
+# Dossiers de travail des traitements (quotas et TTL : variables d'environnement WORKSPACE_*)
+# Au démarrage, supprimer ceux laissés par un worker arrêté brutalement
+# ou par une exécution précédente du service
+workspaces = WorkspaceManager()
+workspaces.cleanup_orphans()
+
+
+# Quota disque dépassé (à la création ou pendant le traitement) : 507 Insufficient Storage
+# (werkzeug n'a pas d'exception HTTP pour ce code, d'où un gestionnaire dédié)
+@app.errorhandler(WorkspaceQuotaExceeded)
+def quota_exceeded(e):
+    return jsonify(error=str(e)), 507
+
+# Préchauffage : bibliothèques, modèles DOCX et données de référence chargés une fois.
+# Avec gunicorn.conf.py (preload_app), cela se fait dans le maître avant le fork des workers.
+# Il est synchrone (un thread ne survivrait pas au fork) : l'application n'accepte
+# aucune requête avant qu'il soit terminé
+warm_up(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils'))
 
 # --------------------------------------------------------
 # 2. Définir la page d'accueil (route "/")
@@ -23,10 +56,29 @@ def index():
     return render_template_string("""
     <h2>Générateur de fiches infractions</h2>
     <form action="/process" method="post" enctype="multipart/form-data">
-        <input type="file" name="csvfile" accept=".csv" required><br><br>
+        <input type="file" name="csvfile" accept="{{ accept }}" required><br>
+        <small>Formats : .csv, .csv.gz, .zip ou .xlsx{% if max_upload_mb %}, {{ max_upload_mb }} Mo au maximum
+            (compresser les gros exports en .csv.gz ou .zip){% endif %}.</small><br><br>
+        <label><input type="checkbox" name="merged_only"> Documents fusionnés par commune uniquement</label><br><br>
+        <label><input type="checkbox" name="streaming"> Traiter une commune à la fois (gros fichiers)</label><br><br>
+        <label><input type="checkbox" name="profile"> Joindre un profil de performance au résultat</label><br><br>
+        <label>Doublons (même afficheur et catégorie à quelques mètres) :
+            <select name="dedup">
+                {% for value, label in dedup_options %}
+                <option value="{{ value }}" {% if value == dedup_default %}selected{% endif %}>{{ label }}</option>
+                {% endfor %}
+            </select>
+        </label><br><br>
         <button type="submit">Lancer le traitement</button>
     </form>
-    """)
+    """, accept=",".join(ALLOWED_EXTENSIONS),
+        max_upload_mb=app.config['MAX_CONTENT_LENGTH'] and app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024),
+        dedup_default=get_dedup_settings()[0], dedup_options=[
+        ('off', 'ne pas rechercher'),
+        ('flag', 'signaler seulement'),
+        ('skip', 'ignorer les doublons'),
+        ('collapse', 'fusionner les doublons'),
+    ])
 
 # --------------------------------------------------------
 # 3. Définir la route "/process" qui gère le traitement
@@ -34,17 +86,53 @@ def index():
 @app.route("/process", methods=["POST"])
 def process():
     # -----------------------------------------------------
-    # a. Créer un dossier temporaire unique pour cette session
+    # a. Créer un dossier de travail unique pour cette session
     #    (chaque utilisateur ou usage aura son propre dossier isolé)
+    #    Il est supprimé dès que le ZIP est prêt à être envoyé, en cas d'erreur
+    #    ou au plus tard à l'expiration du TTL
+    # -----------------------------------------------------
+    job_id, temp_dir = workspaces.create()
+
+    try:
+        zip_path = run_job(job_id, temp_dir)
+    except BaseException:
+        workspaces.release(job_id)
+        raise
+
     # -----------------------------------------------------
-    temp_dir = tempfile.mkdtemp()
+    # h. Retourner le ZIP à télécharger directement dans le navigateur
+    #    Le ZIP est ouvert puis le dossier de travail supprimé tout de suite :
+    #    le fichier ouvert reste lisible jusqu'à la fin de l'envoi (POSIX), et
+    #    son espace disque est libéré quand le serveur le ferme. Les rappels
+    #    call_on_close ne sont pas appelés pour les réponses de send_file
+    #    (direct_passthrough) et ne conviennent donc pas ici
+    # -----------------------------------------------------
+    try:
+        zip_file = open(zip_path, 'rb')
+    finally:
+        workspaces.release(job_id)
+    return send_file(zip_file, mimetype='application/zip', as_attachment=True, download_name="resultats.zip")
+
 
+def run_job(job_id, temp_dir):
+    """
+    Exécute le traitement d'un fichier reçu dans son dossier de travail.
+    Retourne le chemin du ZIP de résultats.
+    """
     # -----------------------------------------------------
-    # b. Enregistrer le fichier CSV reçu depuis le formulaire
+    # b. Recevoir le fichier (.csv, .csv.gz, .zip ou .xlsx) : werkzeug
+    #    l'écrit au fil de l'eau directement dans le dossier de travail
     # -----------------------------------------------------
+    request.upload_dir = temp_dir
     csv_file = request.files['csvfile']
-    csv_path = os.path.join(temp_dir, 'data.csv')
-    csv_file.save(csv_path)
+    csv_file.stream.close()
+    try:
+        extension = detect_extension(csv_file.filename)
+    except UploadError as e:
+        abort(400, description=str(e))
+    csv_path = os.path.join(temp_dir, f'data{extension}')
+    os.replace(csv_file.stream.name, csv_path)
+    workspaces.check_quota(job_id)
 
     # -----------------------------------------------------
     # c. Initialiser tes chemins de travail en utilisant ton init_paths
@@ -55,45 +143,107 @@ def process():
     paths = init_paths(temp_dir)
 
     # -----------------------------------------------------
-    # d. Déplacer le CSV vers import_csv comme tu le fais d'habitude
+    # d. Déplacer le fichier reçu vers import_csv comme tu le fais d'habitude
     # -----------------------------------------------------
-    shutil.move(csv_path, os.path.join(paths['import_csv_dir'], 'data.csv'))
+    import_path = os.path.join(paths['import_csv_dir'], os.path.basename(csv_path))
+    shutil.move(csv_path, import_path)
 
     # -----------------------------------------------------
-    # e. Charger les données et ton mapping
+    # e. Charger les données (décompressées à la lecture) et ton mapping
     # -----------------------------------------------------
-    csv_data = pd.read_csv(
-        os.path.join(paths['import_csv_dir'], 'data.csv'),
-        dtype=str, keep_default_na=False
-    )
+    try:
+        csv_data = read_uploaded_table(import_path, extension)
+    except UploadError as e:
+        abort(400, description=str(e))
     department_mapping = load_department_mapping(paths['utils_dir'])
     date_today = get_date_today()
 
     # -----------------------------------------------------
-    # f. Appeler exactement ton pipeline habituel
+    # e bis. Détecter les dispositifs saisis en double avant les étapes coûteuses
+    #        (mode du formulaire, sinon DEDUP_MODE ; rayon DEDUP_RADIUS_M)
     # -----------------------------------------------------
-    docx_files_by_folder = generate_fiches(csv_data, paths, department_mapping, date_today)
-    generate_courriers(csv_data, paths['BASE_DIR'], paths['utils_dir'])
-    merge_docx_per_commune(docx_files_by_folder)
+    dedup_mode, dedup_radius_m = get_dedup_settings()
+    if request.form.get('dedup') in DEDUP_MODES:
+        dedup_mode = request.form['dedup']
+    duplicates_report = None
+    if dedup_mode != 'off':
+        csv_data, duplicates_report = deduplicate_dispositifs(csv_data, dedup_mode, dedup_radius_m)
 
     # -----------------------------------------------------
-    # g. Créer un ZIP avec le dossier 'dossiers_generes'
-    # -----------------------------------------------------
+    # f. Appeler exactement ton pipeline habituel
+    #    En mode streaming, chaque commune est générée, archivée
+    #    puis supprimée avant de passer à la suivante
+    # -----------------------------------------------------
+    merged_only = is_flag_set(request.form.get('merged_only'))
+    # Quotas vérifiés après chaque fichier écrit (photo, fiche, courrier, ajout au ZIP) :
+    # le traitement s'arrête dès qu'ils sont dépassés
+    check_quota = workspaces.quota_checker(job_id)
+    http = HttpClient(deadline=get_job_deadline_seconds())
+    # Profilage optionnel (champ "profile" ou variable PROFILE_PIPELINE), sans coût s'il est désactivé
+    profiler = PipelineProfiler(enabled=is_flag_set(request.form.get('profile'))
+                                or is_flag_set(os.environ.get('PROFILE_PIPELINE')))
     zip_path = os.path.join(temp_dir, "resultats.zip")
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(os.path.join(temp_dir, "dossiers_generes")):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, os.path.join(temp_dir, "dossiers_generes"))
-                zipf.write(file_path, arcname=arcname)
+    try:
+        if is_flag_set(request.form.get('streaming')):
+            run_streaming_pipeline(csv_data, paths, department_mapping, date_today, zip_path,
+                                   merged_only=merged_only, http=http, profiler=profiler,
+                                   check_quota=check_quota)
+        else:
+            with profiler.stage('generate_fiches'):
+                docx_files_by_folder = generate_fiches(csv_data, paths, department_mapping, date_today,
+                                                       merged_only=merged_only, http=http,
+                                                       check_quota=check_quota)
+            with profiler.stage('generate_courriers'):
+                generate_courriers(csv_data, paths['BASE_DIR'], paths['utils_dir'], http=http,
+                                   check_quota=check_quota)
+            if not merged_only:
+                with profiler.stage('merge_docx_per_commune'):
+                    merge_docx_per_commune(docx_files_by_folder, check_quota=check_quota)
 
-    # -----------------------------------------------------
-    # h. Retourner le ZIP à télécharger directement dans le navigateur
-    # -----------------------------------------------------
-    return send_file(zip_path, as_attachment=True, download_name="resultats.zip")
+            # -----------------------------------------------------
+            # g. Créer un ZIP avec le dossier 'dossiers_generes'
+            # -----------------------------------------------------
+            with profiler.stage('zip'), zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                output_dir = os.path.join(temp_dir, "dossiers_generes")
+                add_directory_to_zip(zipf, output_dir, output_dir, check_quota=check_quota)
+
+        # Rapport des doublons ajouté à l'archive
+        if duplicates_report is not None:
+            with zipfile.ZipFile(zip_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
+                zipf.writestr(DEDUP_REPORT_NAME, duplicates_report.to_csv(index=False))
+
+        # Rapport de profilage ajouté à l'archive et conservé dans le dossier du traitement
+        if profiler.enabled:
+            report = profiler.report()
+            with open(os.path.join(temp_dir, REPORT_NAME), 'w', encoding='utf-8') as f:
+                f.write(report)
+            with zipfile.ZipFile(zip_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
+                zipf.writestr(REPORT_NAME, report)
+    finally:
+        profiler.stop()
+    workspaces.check_quota(job_id)
+
+    # Résumé du traitement (nouvelles tentatives et disjoncteurs HTTP)
+    logging.info(http.summary())
+    return zip_path
+
+# --------------------------------------------------------
+# 4. Route "/status" : occupation disque des dossiers de travail
+# --------------------------------------------------------
+@app.route("/status", methods=["GET"])
+def status():
+    return jsonify(workspaces.status())
+
+# --------------------------------------------------------
+# 5. Route "/healthz" : mesures du préchauffage et mémoire du worker
+#    (le préchauffage précède toujours la première requête)
+# --------------------------------------------------------
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify(warmup_status())
 
 # --------------------------------------------------------
-# 4. Lancer l'application Flask en mode debug
+# 6. Lancer l'application Flask en mode debug
 # --------------------------------------------------------
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
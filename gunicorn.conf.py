@@ -0,0 +1,34 @@
+# gunicorn.conf.py
+# Configuration gunicorn : l'application (et son préchauffage, voir utils/warmup.py)
+# est chargée dans le maître avant le fork, les workers partagent ces pages mémoire.
+import gc
+import os
+
+from utils.http_client import get_job_deadline_seconds, get_worker_timeout_seconds
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Traitements longs (téléchargement des photos, génération des DOCX) ; l'échéance des
+# appels réseau d'un traitement (HTTP_JOB_DEADLINE_SECONDS) en est déduite et reste en dessous
+timeout = get_worker_timeout_seconds()
+preload_app = True
+
+
+def when_ready(server):
+    from utils.warmup import status, format_memory
+    measures = status()
+    server.log.info(
+        f"Maître prêt : préchauffage {measures.get('duration_seconds')} s, "
+        f"avant : {format_memory(measures.get('memory_before_kb'))} ; "
+        f"après : {format_memory(measures.get('memory_after_kb'))} ; "
+        f"échéance des traitements {get_job_deadline_seconds()} s (délai des workers {timeout} s)"
+    )
+    # Sortir les objets préchargés du ramasse-miettes : sans cela, ses passages
+    # écrivent dans ces pages et cassent le partage en copie sur écriture
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from utils.warmup import memory_kb, format_memory
+    server.log.info(f"Worker {worker.pid} démarré ({format_memory(memory_kb())})")
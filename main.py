@@ -7,7 +7,7 @@ from datetime import datetime
 import requests
 import shutil
 import pandas as pd
-from docxtpl import DocxTemplate, InlineImage
+from docxtpl import InlineImage
 from docx.shared import Mm
 
 def configure_logging():
@@ -73,6 +73,19 @@ def get_date_today():
     """
     return datetime.now().strftime('%d/%m/%Y')
 
+# Nouvelle fonction pour interpréter une option (variable d'environnement ou case à cocher)
+def is_flag_set(value):
+    """
+    Interpret an on/off option coming from an environment variable or an HTML checkbox.
+    
+    Parameters:
+        value (str | None): Raw value ('1', 'true', 'on', ...).
+        
+    Returns:
+        bool: True if the option is enabled.
+    """
+    return str(value or '').strip().lower() in ('1', 'true', 'on', 'yes', 'oui')
+
 # Nouvelle fonction pour initialiser les chemins de dossiers utilisés dans le script
 def init_paths(base_dir):
     """
@@ -127,10 +140,13 @@ def load_csv_dataset(import_csv_dir):
     csv_data['Images'] = csv_data['Images'].str.split('|').str[0]
     return csv_data
 
+_department_mapping_cache = {}
+
 def load_department_mapping(utils_dir):
     """
     Load the department mapping from CSV file, mapping department numbers to names.
     Pads department numbers with zeros when necessary.
+    The mapping is parsed once per process (preloaded by utils.warmup) and cached.
     
     Parameters:
         utils_dir (str): Path to utils directory containing 'departements-region.csv'.
@@ -138,7 +154,11 @@ def load_department_mapping(utils_dir):
     Returns:
         dict: Mapping of department number (str) to department name (str).
     """
+    from utils.warmup import file_cache_key
     departments_csv_path = os.path.join(utils_dir, 'departements-region.csv')
+    cache_key = file_cache_key(departments_csv_path)
+    if cache_key in _department_mapping_cache:
+        return dict(_department_mapping_cache[cache_key])
     departments_data = pd.read_csv(
         departments_csv_path,
         dtype={'num_dep': str}
@@ -147,29 +167,75 @@ def load_department_mapping(utils_dir):
     departments_data['num_dep'] = departments_data['num_dep'].str.zfill(2)
     # Create a dictionary mapping 'num_dep' to 'dep_name'
     department_mapping = departments_data.set_index('num_dep')['dep_name'].to_dict()
-    return department_mapping
+    _department_mapping_cache[cache_key] = department_mapping
+    return dict(department_mapping)
+
+
+# Nouvelle fonction pour attribuer les noms de fichiers des fiches
+def fiche_filenames(csv_data):
+    """
+    Assign the DOCX filename of every row that has an infraction, in file order.
+    Handles filename conflicts: if a base name is already used, 'X' and a counter are appended.
+    
+    Parameters:
+        csv_data (pd.DataFrame): DataFrame with all infraction data.
+        
+    Returns:
+        dict: Mapping from row index to DOCX filename.
+    """
+    filenames = {}
+    # Counter to track duplicate filenames for naming conflicts
+    name_counter = {}
+    for index, row in csv_data.iterrows():
+        # Rows without any infraction are skipped by generate_fiches and get no file
+        if not (row.get('infraction_publicite') or row.get('infraction_enseigne') or row.get('infraction_rlpi')):
+            continue
+        base_name = row['Nom']
+        if base_name in name_counter:
+            name_counter[base_name] += 1
+            filenames[index] = f"{base_name}X{name_counter[base_name]:02d}.docx"
+        else:
+            name_counter[base_name] = 0
+            filenames[index] = f"{base_name}.docx"
+    return filenames
 
 
 # Nouvelle fonction pour générer les fiches individuelles
-def generate_fiches(csv_data, paths, department_mapping, date_today):
+def generate_fiches(csv_data, paths, department_mapping, date_today, merged_only=False, filenames=None,
+                    http=None, check_quota=None):
     """
     Generate individual DOCX fiches (reports) for each row in the CSV data.
     Copies a template directory for each city/department and populates DOCX files with data.
     Downloads and embeds images, handles address cleaning, and manages naming conflicts.
+
+    In merged-only mode, each fiche is rendered in memory and appended directly
+    (with a page break) to its commune document; no individual file is written.
     
     Parameters:
         csv_data (pd.DataFrame): DataFrame with all infraction data.
         paths (dict): Dictionary of directory paths.
         department_mapping (dict): Mapping from department codes to names.
         date_today (str): Current date formatted string.
+        merged_only (bool): Only produce the combined DOCX per commune.
+        filenames (dict): Row index to DOCX filename, from fiche_filenames over the whole CSV
+            (needed when generating commune by commune; computed from csv_data otherwise).
+        http (HttpClient): Outbound HTTP client of the job (timeouts, retries, circuit breaker, deadline).
+        check_quota (callable): Called after each file written; raises WorkspaceQuotaExceeded
+            to stop the job as soon as its disk quota is exceeded.
         
     Returns:
-        dict: Mapping from folder path to list of generated DOCX file paths.
+        dict: Mapping from folder path to list of generated DOCX file paths
+        (the combined file only, in merged-only mode).
     """
     from utils.html_utils import process_html_content
-    from docxtpl import DocxTemplate, InlineImage
+    from utils.http_client import default_client
+    from utils.warmup import load_template
+    from docxtpl import InlineImage
     from docx.shared import Mm
     from PIL import Image
+    from docx import Document
+    from docxcompose.composer import Composer
+    import io
     import re
     import requests
     import shutil
@@ -178,11 +244,46 @@ def generate_fiches(csv_data, paths, department_mapping, date_today):
     BASE_DIR = paths['BASE_DIR']
     template_dir = paths['template_dir']
     utils_dir = paths['utils_dir']
+    http = http or default_client()
+    check_quota = check_quota or (lambda: None)
 
     # Dictionary to store generated DOCX files by their folder
     docx_files_by_folder = defaultdict(list)
-    # Counter to track duplicate filenames for naming conflicts
-    name_counter = {}
+    # Filenames are assigned over the whole CSV in file order, whatever the processing order
+    if filenames is None:
+        filenames = fiche_filenames(csv_data)
+    # Merged-only mode: commune document being built (folder, combined filename, composer)
+    merged = {'folder': None, 'name': None, 'composer': None}
+
+    def flush_merged():
+        # Save the commune document currently being built, if any
+        if merged['composer'] is None:
+            return
+        combined_path = os.path.join(merged['folder'], merged['name'])
+        try:
+            merged['composer'].save(combined_path)
+            logging.info(f"Fichier combiné créé : {combined_path}")
+            docx_files_by_folder[merged['folder']].append(combined_path)
+            check_quota()
+        except WorkspaceQuotaExceeded:
+            # Disk quota exceeded: stop the whole job, as for individual fiches
+            raise
+        except Exception as e:
+            # Log the failure against its commune and keep going with the next one
+            logging.error(f"Erreur lors de l'enregistrement du document combiné {combined_path}: {e}")
+        finally:
+            # Always start the next commune from a fresh document
+            merged.update(folder=None, name=None, composer=None)
+
+    if merged_only:
+        logging.info("Mode fusion seule : les fiches individuelles ne seront pas enregistrées.")
+        # Process rows commune by commune, in the same order as merge_docx_per_commune
+        # (sorted by filename), so that each commune document can be saved as soon as it is complete
+        commune_key = csv_data['Code postal'].str[:2] + ' ' + csv_data['Ville'].str.upper()
+        filename_key = csv_data.index.map(lambda i: filenames.get(i, ''))
+        order = csv_data.assign(_commune=commune_key, _filename=filename_key).sort_values(
+            ['_commune', '_filename'], kind='stable').index
+        csv_data = csv_data.loc[order]
 
     logging.info("Début de la génération des fiches individuelles...")
 
@@ -198,6 +299,7 @@ def generate_fiches(csv_data, paths, department_mapping, date_today):
             # Copy template directory if it doesn't exist yet
             if not os.path.exists(model_copy_dir):
                 shutil.copytree(template_dir, model_copy_dir)
+                check_quota()
             infractions_dir = os.path.join(model_copy_dir, '02 Infractions')
             photos_dir = os.path.join(model_copy_dir, '01 Photos')
 
@@ -262,11 +364,19 @@ def generate_fiches(csv_data, paths, department_mapping, date_today):
             default_image_path = os.path.join(photos_dir, 'default.jpg')
 
             if image_url:
-                response = requests.get(image_url)
-                if response.status_code == 200:
+                try:
+                    response = http.get(image_url)
+                except requests.exceptions.RequestException as e:
+                    # Timeout, host unavailable (circuit breaker open) or job deadline reached
+                    logging.error(f"Échec du téléchargement de l'image: {image_url} ({e})")
+                    response = None
+                if response is None:
+                    image_path = default_image_path
+                elif response.status_code == 200:
                     # Save the downloaded image locally
                     with open(image_path, 'wb') as f:
                         f.write(response.content)
+                    check_quota()
                 else:
                     # Log error and use default image if download fails
                     logging.error(f"Échec du téléchargement de l'image: {image_url} avec le status code {response.status_code}")
@@ -298,7 +408,7 @@ def generate_fiches(csv_data, paths, department_mapping, date_today):
 
             # Load the DOCX template for the fiche
             doc_template_path = os.path.join(utils_dir, 'fichev1.docx')
-            doc = DocxTemplate(doc_template_path)
+            doc = load_template(doc_template_path)
             # Prepare the context dictionary for template rendering
             context = {
                 'Latitude': lat_short,
@@ -340,14 +450,26 @@ def generate_fiches(csv_data, paths, department_mapping, date_today):
             if infraction_text:
                 process_html_content(infraction_paragraph, infraction_text)
 
-            # Handle filename conflicts: if base name already used, append 'X' and a counter
-            base_name = row['Nom']
-            if base_name in name_counter:
-                name_counter[base_name] += 1
-                filename = f"{base_name}X{name_counter[base_name]:02d}.docx"
-            else:
-                name_counter[base_name] = 0
-                filename = f"{base_name}.docx"
+            # Filename assigned up front, with 'X' and a counter on naming conflicts
+            filename = filenames[index]
+
+            if merged_only:
+                # Render the fiche in memory and append it to the commune document
+                buffer = io.BytesIO()
+                doc.save(buffer)
+                buffer.seek(0)
+                fiche_doc = Document(buffer)
+                if merged['folder'] != infractions_dir:
+                    flush_merged()
+                    # Combined file name follows merge_docx_per_commune: strip suffix after last hyphen
+                    merged.update(folder=infractions_dir,
+                                  name=filename.rsplit('-', 1)[0] + ".docx",
+                                  composer=Composer(fiche_doc))
+                else:
+                    merged['composer'].doc.add_page_break()
+                    merged['composer'].append(fiche_doc)
+                logging.info(f"Fiche ajoutée au document combiné : {filename}")
+                continue
 
             # Save the rendered DOCX file in the infractions directory
             modified_docx_path = os.path.join(infractions_dir, filename)
@@ -355,16 +477,27 @@ def generate_fiches(csv_data, paths, department_mapping, date_today):
             logging.info(f"Fichier DOCX créé: {modified_docx_path}")
             # Track the saved file by folder for later merging
             docx_files_by_folder[infractions_dir].append(modified_docx_path)
+            check_quota()
+        except WorkspaceQuotaExceeded:
+            # Disk quota exceeded: stop the whole job, not just this fiche
+            raise
         except Exception as e:
             # Log any errors during fiche generation without stopping the loop
             logging.error(f"Erreur lors de la génération de la fiche {row['Nom']} (index {index}): {e}")
 
+    # Save the last commune document in merged-only mode
+    flush_merged()
+
     return docx_files_by_folder
 
 
 
 
-from utils.courrier_infractions import generate_courrier
+from utils.courrier_infractions import generate_courrier, resolve_communes, RESOLVE_MAX_WORKERS
+from utils.http_client import HttpClient, get_job_deadline_seconds
+from utils.profiling import PipelineProfiler, REPORT_NAME
+from utils.duplicates import deduplicate_dispositifs, get_dedup_settings, REPORT_NAME as DEDUP_REPORT_NAME
+from utils.workspace import WorkspaceQuotaExceeded
 
 from utils.commune import fetch_commune_code
 from utils.html_utils import process_html_content
@@ -372,39 +505,57 @@ from utils.html_utils import process_html_content
 
 
 # Génération des courriers pour chaque commune
-def generate_courriers(csv_data, BASE_DIR, utils_dir):
+def generate_courriers(csv_data, BASE_DIR, utils_dir, max_workers=RESOLVE_MAX_WORKERS, http=None,
+                       check_quota=None):
     """
     Generate letters ('courriers') for each unique commune (department code + city) found in the CSV data.
-    Groups rows by commune and calls the courrier generation utility.
+    Groups rows by commune, resolves every commune and its mairie concurrently (bounded thread pool,
+    rate-limited per API host), and renders each letter as soon as its commune data arrives.
     
     Parameters:
         csv_data (pd.DataFrame): DataFrame with all infraction data.
         BASE_DIR (str): Base directory for generated dossiers.
         utils_dir (str): Directory containing utility scripts.
+        max_workers (int): Maximum number of concurrent API lookups.
+        http (HttpClient): Outbound HTTP client of the job.
+        check_quota (callable): Called after each letter; raises WorkspaceQuotaExceeded to stop the job.
     """
-    # Create a set of unique (department code, city) tuples
-    generated_communes = set((row['Code postal'][:2], row['Ville']) for _, row in csv_data.iterrows())
-
-    for dep_code, ville in generated_communes:
-        # Filter rows belonging to the current commune
-        rows = [row for _, row in csv_data.iterrows() if (row['Code postal'][:2], row['Ville']) == (dep_code, ville)]
-        courriers_dir = os.path.join(BASE_DIR, "dossiers_generes", f"{dep_code} {ville.upper()}", '03 Courriers')
-        # Create the courriers directory if it doesn't exist
-        if not os.path.exists(courriers_dir):
-            os.makedirs(courriers_dir)
-        # Generate the courrier documents for this commune
-        generate_courrier(rows, utils_dir, courriers_dir)
+    check_quota = check_quota or (lambda: None)
+    # Group rows by unique (department code, city) tuples, in a single pass
+    rows_by_commune = {}
+    for _, row in csv_data.iterrows():
+        rows_by_commune.setdefault((row['Code postal'][:2], row['Ville']), []).append(row)
+
+    # The letter uses the city and postal code of the first row of each commune
+    communes_by_pair = {}
+    for key, rows in rows_by_commune.items():
+        communes_by_pair.setdefault((rows[0]['Ville'], rows[0]['Code postal']), []).append(key)
+
+    for pair, commune_info in resolve_communes(communes_by_pair, max_workers=max_workers, http=http):
+        if commune_info is None:
+            logging.error(f"Courrier non généré pour {pair[0]} ({pair[1]}) : commune ou mairie introuvable.")
+            continue
+        for dep_code, ville in communes_by_pair[pair]:
+            courriers_dir = os.path.join(BASE_DIR, "dossiers_generes", f"{dep_code} {ville.upper()}", '03 Courriers')
+            # Create the courriers directory if it doesn't exist
+            if not os.path.exists(courriers_dir):
+                os.makedirs(courriers_dir)
+            # Generate the courrier documents for this commune
+            generate_courrier(rows_by_commune[(dep_code, ville)], utils_dir, courriers_dir, commune_info)
+            check_quota()
 
 # Nouvelle fonction pour fusionner les fichiers DOCX par commune
-def merge_docx_per_commune(docx_files_by_folder):
+def merge_docx_per_commune(docx_files_by_folder, check_quota=None):
     """
     Merge individual DOCX files into a single combined DOCX file per folder (commune).
     Moves individual files into an 'indiv' subfolder after merging.
     
     Parameters:
         docx_files_by_folder (dict): Mapping from folder path to list of DOCX file paths.
+        check_quota (callable): Called after each combined file; raises WorkspaceQuotaExceeded to stop the job.
     """
     from utils.merge_docx import merge_docx_files
+    check_quota = check_quota or (lambda: None)
     for folder, files in docx_files_by_folder.items():
         files.sort()
         if files:
@@ -414,6 +565,7 @@ def merge_docx_per_commune(docx_files_by_folder):
             # Merge the DOCX files into one combined document
             merge_docx_files(files, combined_path)
             logging.info(f"Fichier combiné créé : {combined_path}")
+            check_quota()
             # Create an 'indiv' subfolder to store individual files post-merge
             indiv_dir = os.path.join(folder, "indiv")
             os.makedirs(indiv_dir, exist_ok=True)
@@ -428,6 +580,136 @@ def merge_docx_per_commune(docx_files_by_folder):
 from utils.merge_docx import merge_docx_files
 
 
+# Nouvelle fonction pour ajouter un dossier généré à l'archive ZIP
+def add_directory_to_zip(zipf, directory, root, check_quota=None):
+    """
+    Add every file of a directory to an open ZIP archive.
+    
+    Parameters:
+        zipf (zipfile.ZipFile): Archive opened in write mode.
+        directory (str): Directory to add.
+        root (str): Directory the archive names are relative to.
+        check_quota (callable): Called after each file added; raises WorkspaceQuotaExceeded to stop the job.
+    """
+    check_quota = check_quota or (lambda: None)
+    for dirpath, _, files in os.walk(directory):
+        for file in files:
+            file_path = os.path.join(dirpath, file)
+            zipf.write(file_path, arcname=os.path.relpath(file_path, root))
+            check_quota()
+
+
+# Rapport des communes en échec, ajouté à l'archive en mode streaming
+STREAMING_ERRORS_NAME = 'erreurs.txt'
+
+# Nouvelle fonction pour traiter les communes une par une jusqu'à l'archive ZIP
+def run_streaming_pipeline(csv_data, paths, department_mapping, date_today, zip_path,
+                           merged_only=False, max_workers=RESOLVE_MAX_WORKERS, http=None, profiler=None,
+                           check_quota=None):
+    """
+    Generate the results commune by commune and write them straight into a ZIP archive.
+    For each commune folder: fiches, merge, courriers, add to the archive, then delete the
+    scratch files. Peak disk use depends on the largest commune instead of the whole export;
+    the archive contents are the same as with the batch pipeline. Communes that fail are
+    listed in 'erreurs.txt' inside the archive.
+    Communes and mairies are still resolved concurrently; each commune is processed as soon
+    as all of its lookups are done.
+    
+    Parameters:
+        csv_data (pd.DataFrame): DataFrame with all infraction data.
+        paths (dict): Dictionary of directory paths.
+        department_mapping (dict): Mapping from department codes to names.
+        date_today (str): Current date formatted string.
+        zip_path (str): Path of the ZIP archive to create.
+        merged_only (bool): Only produce the combined DOCX per commune.
+        max_workers (int): Maximum number of concurrent API lookups.
+        http (HttpClient): Outbound HTTP client of the job.
+        profiler (PipelineProfiler): Per-stage profiler (stages accumulate across communes).
+        check_quota (callable): Called after each file written; WorkspaceQuotaExceeded aborts
+            the whole archive instead of being reported as a failed commune.
+    """
+    import zipfile
+
+    profiler = profiler or PipelineProfiler()
+    check_quota = check_quota or (lambda: None)
+
+    BASE_DIR = paths['BASE_DIR']
+    utils_dir = paths['utils_dir']
+    output_dir = os.path.join(BASE_DIR, "dossiers_generes")
+
+    # Folder name of each row, as built by generate_fiches
+    folder_names = csv_data['Code postal'].str[:2] + ' ' + csv_data['Ville'].str.upper()
+
+    # Courrier groups (department code, city) of each folder, as built by generate_courriers
+    rows_by_commune = {}
+    for _, row in csv_data.iterrows():
+        rows_by_commune.setdefault((row['Code postal'][:2], row['Ville']), []).append(row)
+    pending_pairs = {}
+    folders_by_pair = {}
+    for (dep_code, ville), rows in rows_by_commune.items():
+        folder = f"{dep_code} {ville.upper()}"
+        pair = (rows[0]['Ville'], rows[0]['Code postal'])
+        pending_pairs.setdefault(folder, set()).add(pair)
+        folders_by_pair.setdefault(pair, []).append(folder)
+
+    # Filenames over the whole CSV, so that X suffixes match the batch pipeline
+    filenames = fiche_filenames(csv_data)
+    commune_infos = {}
+
+    def process_folder(zipf, folder):
+        # Fiches and merge for this commune only
+        with profiler.stage('generate_fiches'):
+            docx_files_by_folder = generate_fiches(csv_data[folder_names == folder], paths, department_mapping,
+                                                   date_today, merged_only=merged_only, filenames=filenames,
+                                                   http=http, check_quota=check_quota)
+        if not merged_only:
+            with profiler.stage('merge_docx_per_commune'):
+                merge_docx_per_commune(docx_files_by_folder, check_quota=check_quota)
+        # Courriers for every (department code, city) group of this folder
+        courriers_dir = os.path.join(output_dir, folder, '03 Courriers')
+        for (dep_code, ville), rows in rows_by_commune.items():
+            if f"{dep_code} {ville.upper()}" != folder:
+                continue
+            commune_info = commune_infos.get((rows[0]['Ville'], rows[0]['Code postal']))
+            if commune_info is None:
+                logging.error(f"Courrier non généré pour {ville} : commune ou mairie introuvable.")
+                continue
+            os.makedirs(courriers_dir, exist_ok=True)
+            with profiler.stage('generate_courriers'):
+                generate_courrier(rows, utils_dir, courriers_dir, commune_info)
+            check_quota()
+        # Ship the commune to the archive (its scratch files are removed by the caller)
+        folder_dir = os.path.join(output_dir, folder)
+        if os.path.isdir(folder_dir):
+            with profiler.stage('zip'):
+                add_directory_to_zip(zipf, folder_dir, output_dir, check_quota=check_quota)
+        logging.info(f"Commune traitée et archivée : {folder}")
+
+    failures = []
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for pair, commune_info in resolve_communes(folders_by_pair, max_workers=max_workers, http=http):
+            commune_infos[pair] = commune_info
+            for folder in folders_by_pair[pair]:
+                pending_pairs[folder].discard(pair)
+                if not pending_pairs[folder]:
+                    try:
+                        process_folder(zipf, folder)
+                    except WorkspaceQuotaExceeded:
+                        # Disk quota exceeded: abort the job rather than skipping this commune
+                        raise
+                    except Exception as e:
+                        # Log the error, report it in the archive and keep going with the other communes
+                        logging.error(f"Erreur lors du traitement de la commune {folder}: {e}")
+                        failures.append(f"{folder} : {e}")
+                    finally:
+                        # Never leave a commune's scratch files behind, even after a failure
+                        shutil.rmtree(os.path.join(output_dir, folder), ignore_errors=True)
+        if failures:
+            zipf.writestr(STREAMING_ERRORS_NAME, "Communes non générées ou incomplètes :\n" + "\n".join(failures) + "\n")
+
+    logging.info(f"Archive créée : {zip_path}")
+
+
 # ========================== MAIN WRAPPER ==========================
 def main():
     """
@@ -438,6 +720,13 @@ def main():
     4. Generates individual fiches (reports).
     5. Generates courriers (letters) for each commune.
     6. Merges individual DOCX files per commune.
+
+    Set the MERGED_ONLY environment variable (1/true/on) to only produce
+    the combined DOCX per commune, and STREAMING to process one commune at
+    a time straight into 'resultats.zip' (steps 4 to 6 per commune).
+    Set PROFILE_PIPELINE to write a per-stage profile to 'profil_pipeline.txt'.
+    Set DEDUP_MODE (flag/skip/collapse) and DEDUP_RADIUS_M to detect duplicate
+    dispositifs before generation; the report is written to 'doublons.csv'.
     """
     # Définir la locale et obtenir la date du jour
     date_today = get_date_today()
@@ -454,14 +743,48 @@ def main():
     # Charger le mapping des départements
     department_mapping = load_department_mapping(utils_dir)
 
-    # Générer les fiches
-    docx_files_by_folder = generate_fiches(csv_data, paths, department_mapping, date_today)
-
-    # Générer les courriers
-    generate_courriers(csv_data, BASE_DIR, utils_dir)
-
-    # Fusionner les fichiers DOCX
-    merge_docx_per_commune(docx_files_by_folder)
+    # Détecter les dispositifs saisis en double (et les retirer selon le mode)
+    dedup_mode, dedup_radius_m = get_dedup_settings()
+    if dedup_mode != 'off':
+        csv_data, duplicates_report = deduplicate_dispositifs(csv_data, dedup_mode, dedup_radius_m)
+        duplicates_report.to_csv(os.path.join(BASE_DIR, DEDUP_REPORT_NAME), index=False)
+
+    # Mode de sortie : fiches individuelles + fusion (défaut) ou fusion seule
+    merged_only = is_flag_set(os.environ.get('MERGED_ONLY'))
+
+    # Client HTTP du traitement (délais, nouvelles tentatives, disjoncteur, échéance globale)
+    http = HttpClient(deadline=get_job_deadline_seconds())
+
+    # Profilage optionnel des étapes (sans coût s'il est désactivé)
+    profiler = PipelineProfiler(enabled=is_flag_set(os.environ.get('PROFILE_PIPELINE')))
+
+    if is_flag_set(os.environ.get('STREAMING')):
+        # Mode streaming : une commune à la fois, directement dans l'archive ZIP
+        zip_path = os.path.join(BASE_DIR, "resultats.zip")
+        run_streaming_pipeline(csv_data, paths, department_mapping, date_today, zip_path,
+                               merged_only=merged_only, http=http, profiler=profiler)
+    else:
+        # Générer les fiches
+        with profiler.stage('generate_fiches'):
+            docx_files_by_folder = generate_fiches(csv_data, paths, department_mapping, date_today,
+                                                   merged_only=merged_only, http=http)
+
+        # Générer les courriers
+        with profiler.stage('generate_courriers'):
+            generate_courriers(csv_data, BASE_DIR, utils_dir, http=http)
+
+        # Fusionner les fichiers DOCX (déjà fait pendant la génération en mode fusion seule)
+        if not merged_only:
+            with profiler.stage('merge_docx_per_commune'):
+                merge_docx_per_commune(docx_files_by_folder)
+
+    # Résumé du traitement
+    logging.info(http.summary())
+    if profiler.enabled:
+        report_path = os.path.join(BASE_DIR, REPORT_NAME)
+        profiler.write_report(report_path)
+        profiler.stop()
+        logging.info(f"Profil du traitement écrit : {report_path}")
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,19 @@
 # utils/commune.py
 import requests
 import logging
+from utils.http_client import default_client
 
-def fetch_commune_code(commune_name, postal_code):
+def fetch_commune_code(commune_name, postal_code, http=None):
     """
     Trouve le code INSEE d'une commune en utilisant son nom et son code postal.
     :param commune_name: Nom de la commune
     :param postal_code: Code postal de la commune
+    :param http: Client HTTP du traitement (utils.http_client.HttpClient)
     :return: Code INSEE de la commune ou None si non trouvé
     """
-    url = f"https://geo.api.gouv.fr/communes?nom={commune_name}&limit=100"
+    url = "https://geo.api.gouv.fr/communes"
     try:
-        response = requests.get(url)
+        response = (http or default_client()).get(url, params={'nom': commune_name, 'limit': 100}, use_cache=True)
         response.raise_for_status()  # Vérifie si la requête a réussi
         data = response.json()  # Conversion du résultat en JSON
 
@@ -7,15 +7,19 @@ pour les infractions d'une commune.
 """
 
 import os
-import sys
 import csv
+import time
+import threading
 import unicodedata
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from docxtpl import DocxTemplate
+from urllib.parse import urlsplit
 from datetime import datetime
-from typing import Optional
+from typing import Iterable, Iterator, Optional
+from utils.http_client import HttpClient, default_client
+from utils.warmup import load_template
 
 
 
@@ -23,34 +27,66 @@ from typing import Optional
 GEO_URL = "https://geo.api.gouv.fr/communes"
 MAIRIE_URL = "https://etablissements-publics.api.gouv.fr/v3/communes/{insee}/mairie"
 
+# Résolution concurrente des communes : nombre de threads et débit maximal par hôte (requêtes/s),
+# en dessous des quotas des API publiques (50 req/s par IP pour geo.api.gouv.fr)
+RESOLVE_MAX_WORKERS = 8
+API_RATE_PER_HOST = 10.0
+
+
+class HostRateLimiter:
+    """
+    Limite le débit des requêtes par hôte, partagé entre threads.
+    Chaque appel à wait() réserve le prochain créneau libre de l'hôte et attend jusqu'à celui-ci.
+    HttpClient.get l'appelle avant chaque essai, nouvelles tentatives comprises.
+    """
+
+    def __init__(self, rate_per_host: float = API_RATE_PER_HOST):
+        self.interval = 1.0 / rate_per_host if rate_per_host > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
 
 def strip_accents(s: str) -> str:
     """Supprime les accents et passe en minuscules pour comparer."""
     return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn").lower()
 
 
-def find_commune(ville: str, cp: str) -> dict:
-    """Retourne le dictionnaire de la commune via l’API geo.api.gouv.fr."""
+def find_commune(ville: str, cp: str, rate_limiter: Optional[HostRateLimiter] = None,
+                 http: Optional[HttpClient] = None) -> dict:
+    """Retourne le dictionnaire de la commune via l’API geo.api.gouv.fr (LookupError si introuvable)."""
     params = {
         "nom": ville,
         "codePostal": cp,
         "fields": "nom,code,codesPostaux,population",
         "format": "json",
     }
-    resp = requests.get(GEO_URL, params=params, timeout=4)
+    resp = (http or default_client()).get(GEO_URL, params=params, timeout=4, use_cache=True,
+                                          rate_limiter=rate_limiter)
     resp.raise_for_status()
     communes = resp.json()
     if not communes:
-        sys.exit(f"Aucune commune '{ville}' (CP {cp}) trouvée.")
+        raise LookupError(f"Aucune commune '{ville}' (CP {cp}) trouvée.")
     # Filtrer sur le nom exact (accents ignorés)
     exact = [c for c in communes if strip_accents(c["nom"]) == strip_accents(ville)]
     choix = exact or communes
     return max(choix, key=lambda c: c.get("population", 0))
 
 
-def get_mairie_address(insee: str) -> str:
+def get_mairie_address(insee: str, rate_limiter: Optional[HostRateLimiter] = None,
+                       http: Optional[HttpClient] = None) -> str:
     """Récupère l’adresse de la mairie via l’API établissements-publics."""
-    resp = requests.get(MAIRIE_URL.format(insee=insee), timeout=4)
+    url = MAIRIE_URL.format(insee=insee)
+    resp = (http or default_client()).get(url, timeout=4, use_cache=True, rate_limiter=rate_limiter)
     resp.raise_for_status()
     features = resp.json().get("features", [])
     if not features:
@@ -64,6 +100,46 @@ def get_mairie_address(insee: str) -> str:
     return "Adresse non disponible"
 
 
+def resolve_commune(ville: str, cp: str, rate_limiter: Optional[HostRateLimiter] = None,
+                    http: Optional[HttpClient] = None) -> dict:
+    """
+    Résout le code INSEE et l'adresse de la mairie d'une commune.
+    Retourne un dictionnaire {"insee": ..., "mairie_address": ...} utilisable par generate_courrier.
+    """
+    commune = find_commune(ville, cp, rate_limiter, http)
+    insee = commune["code"]
+    return {"insee": insee, "mairie_address": get_mairie_address(insee, rate_limiter, http)}
+
+
+def resolve_communes(pairs: Iterable[tuple], max_workers: int = RESOLVE_MAX_WORKERS,
+                     rate_per_host: float = API_RATE_PER_HOST,
+                     http: Optional[HttpClient] = None) -> Iterator[tuple]:
+    """
+    Résout en parallèle toutes les paires (ville, code postal), avec un débit limité par hôte.
+    Les résultats sont produits au fil de l'eau, dans l'ordre où ils arrivent :
+    ((ville, cp), infos) où infos vaut None si la résolution a échoué.
+    Si l'appelant s'interrompt (exception, quota dépassé), les résolutions pas encore
+    commencées sont annulées au lieu d'être exécutées avant que l'erreur ne remonte.
+    """
+    rate_limiter = HostRateLimiter(rate_per_host)
+    pairs = list(dict.fromkeys(pairs))
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pairs) or 1)))
+    try:
+        futures = {executor.submit(resolve_commune, ville, cp, rate_limiter, http): (ville, cp)
+                   for ville, cp in pairs}
+        for future in as_completed(futures):
+            ville, cp = futures[future]
+            try:
+                yield (ville, cp), future.result()
+            except (requests.exceptions.RequestException, LookupError, ValueError) as e:
+                # Commune introuvable, API indisponible ou réponse invalide : on ne bloque pas les autres
+                logging.error(f"Impossible de résoudre la commune '{ville}' (CP {cp}) : {e}")
+                yield (ville, cp), None
+    finally:
+        # Sans effet si tout a été consommé ; sinon, ne pas attendre les résolutions restantes
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def get_mayor_name_from_csv(insee_code: str, utils_dir: str) -> Optional[str]:
     """
     Cherche le maire dans utils/RNE.csv à partir du code INSEE.
@@ -88,11 +164,12 @@ def get_mayor_name_from_csv(insee_code: str, utils_dir: str) -> Optional[str]:
     return None
 
 
-def generate_courrier(fiches: list[dict], utils_dir: str, courriers_dir: str):
+def generate_courrier(fiches: list[dict], utils_dir: str, courriers_dir: str, commune_info: Optional[dict] = None):
     """
     Génère dans `courriers_dir` pour la commune représentée par `fiches` :
       - un fichier Lettre_Infractions_<Commune>.docx
       - un fichier destinataires.txt
+    Si `commune_info` (résultat de resolve_commune) est fourni, les API ne sont pas rappelées.
     """
     if not fiches:
         logging.warning("Aucune fiche transmise au module de courrier.")
@@ -103,9 +180,10 @@ def generate_courrier(fiches: list[dict], utils_dir: str, courriers_dir: str):
     cp = fiches[0]["Code postal"]
 
     # Recherche INSEE et mairie
-    commune = find_commune(ville, cp)
-    insee = commune["code"]
-    mairie_address = get_mairie_address(insee)
+    if commune_info is None:
+        commune_info = resolve_commune(ville, cp)
+    insee = commune_info["insee"]
+    mairie_address = commune_info["mairie_address"]
 
     # Recherche du maire
     mayor = get_mayor_name_from_csv(insee, utils_dir) or ""
@@ -134,7 +212,7 @@ def generate_courrier(fiches: list[dict], utils_dir: str, courriers_dir: str):
     if not os.path.isfile(letter_template):
         logging.error(f"Template lettre introuvable : {letter_template}")
         return
-    lettre_doc = DocxTemplate(letter_template)
+    lettre_doc = load_template(letter_template)
 
     # Contexte pour la lettre
     date_str = datetime.now().strftime("%d/%m/%Y")
@@ -0,0 +1,147 @@
+# utils/duplicates.py
+"""
+Détection des dispositifs saisis en double avant la génération des fiches.
+
+Deux lignes sont des doublons si elles ont le même afficheur, la même catégorie
+et des coordonnées distantes d'au plus `radius_m` mètres. Les points sont rangés
+dans une grille de cellules de `radius_m` de côté : chaque ligne n'est comparée
+qu'aux lignes conservées des 9 cellules voisines, soit un temps proche de O(n).
+
+Modes :
+  - 'off'      : aucune détection (défaut) ;
+  - 'flag'     : rapport des doublons, toutes les lignes sont conservées ;
+  - 'skip'     : les doublons sont retirés ;
+  - 'collapse' : les doublons sont retirés et leurs champs non vides complètent
+                 les champs vides de la ligne conservée (photo, infraction, surface...).
+"""
+
+import math
+import os
+import logging
+import pandas as pd
+
+DEDUP_MODES = ('off', 'flag', 'skip', 'collapse')
+DEFAULT_RADIUS_M = 5.0
+# Nom du rapport dans l'archive ou le dossier du traitement
+REPORT_NAME = 'doublons.csv'
+
+# Mètres par degré de latitude (approximation équirectangulaire, suffisante à quelques mètres)
+METERS_PER_DEGREE = 111_320.0
+EARTH_RADIUS_M = 6_371_000.0
+
+REPORT_COLUMNS = ['Nom conservé', 'Nom doublon', 'distance_m', 'afficheur', 'catégorie', 'action']
+
+
+def get_dedup_settings():
+    """Retourne (mode, rayon en mètres) lus dans DEDUP_MODE et DEDUP_RADIUS_M."""
+    mode = os.environ.get('DEDUP_MODE', 'off').strip().lower() or 'off'
+    if mode not in DEDUP_MODES:
+        logging.warning(f"DEDUP_MODE invalide ({mode}), détection des doublons désactivée.")
+        mode = 'off'
+    value = os.environ.get('DEDUP_RADIUS_M', '')
+    try:
+        radius_m = float(value) if value else DEFAULT_RADIUS_M
+    except ValueError:
+        logging.warning(f"DEDUP_RADIUS_M invalide ({value}), utilisation de la valeur par défaut.")
+        radius_m = DEFAULT_RADIUS_M
+    return mode, radius_m
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance en mètres entre deux points GPS."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _normalize(value) -> str:
+    return " ".join(str(value or '').split()).lower()
+
+
+def find_duplicates(csv_data: pd.DataFrame, radius_m: float = DEFAULT_RADIUS_M) -> list:
+    """
+    Repère les lignes en double dans un rayon donné.
+    La première occurrence (ordre du fichier) est conservée ; les lignes suivantes
+    qui la recoupent lui sont rattachées. Les lignes sans coordonnées valides sont ignorées.
+    :param csv_data: Données d'entrée (colonnes Latitude, Longitude, afficheur, Catégories (libellés))
+    :param radius_m: Rayon en mètres
+    :return: Liste de (index doublon, index conservé, distance en mètres)
+    """
+    cell_m = max(radius_m, 0.1)
+    grid = {}
+    duplicates = []
+
+    def column(name):
+        return csv_data[name].tolist() if name in csv_data.columns else [''] * len(csv_data)
+
+    # Parcours par colonnes : bien plus rapide que iterrows sur de gros exports
+    for index, lat, lon, afficheur, categorie in zip(csv_data.index, column('Latitude'), column('Longitude'),
+                                                     column('afficheur'), column('Catégories (libellés)')):
+        try:
+            lat = float(lat)
+            lon = float(lon)
+        except (ValueError, TypeError):
+            continue
+        if math.isnan(lat) or math.isnan(lon):
+            continue
+        key = (_normalize(afficheur), _normalize(categorie))
+        # Projection locale en mètres : la longitude est corrigée par cos(latitude)
+        y = lat * METERS_PER_DEGREE
+        x = lon * METERS_PER_DEGREE * math.cos(math.radians(lat))
+        cell = (int(math.floor(y / cell_m)), int(math.floor(x / cell_m)))
+
+        match = None
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for kept_index, kept_lat, kept_lon, kept_key in grid.get((cell[0] + dy, cell[1] + dx), ()):
+                    if kept_key != key:
+                        continue
+                    distance = haversine_m(lat, lon, kept_lat, kept_lon)
+                    if distance <= radius_m and (match is None or distance < match[1]):
+                        match = (kept_index, distance)
+        if match:
+            duplicates.append((index, match[0], round(match[1], 2)))
+        else:
+            grid.setdefault(cell, []).append((index, lat, lon, key))
+    return duplicates
+
+
+def deduplicate_dispositifs(csv_data: pd.DataFrame, mode: str = 'off', radius_m: float = DEFAULT_RADIUS_M):
+    """
+    Applique le mode de dédoublonnage avant la génération des fiches.
+    :param csv_data: Données d'entrée
+    :param mode: 'off', 'flag', 'skip' ou 'collapse'
+    :param radius_m: Rayon en mètres
+    :return: (données à traiter, rapport des doublons en DataFrame)
+    """
+    if mode == 'off' or csv_data.empty:
+        return csv_data, pd.DataFrame(columns=REPORT_COLUMNS)
+
+    duplicates = find_duplicates(csv_data, radius_m)
+    action = {'flag': 'signalé', 'skip': 'ignoré', 'collapse': 'fusionné'}[mode]
+    report = pd.DataFrame([
+        {
+            'Nom conservé': csv_data.at[kept, 'Nom'],
+            'Nom doublon': csv_data.at[dup, 'Nom'],
+            'distance_m': distance,
+            'afficheur': csv_data.at[dup, 'afficheur'],
+            'catégorie': csv_data.at[dup, 'Catégories (libellés)'],
+            'action': action,
+        }
+        for dup, kept, distance in duplicates
+    ], columns=REPORT_COLUMNS)
+    logging.info(f"{len(duplicates)} doublon(s) détecté(s) dans un rayon de {radius_m} m (mode {mode}).")
+
+    if mode == 'flag' or not duplicates:
+        return csv_data, report
+
+    result = csv_data.drop(index=[dup for dup, _, _ in duplicates])
+    if mode == 'collapse':
+        result = result.copy()
+        for dup, kept, _ in duplicates:
+            for column in result.columns:
+                if not str(result.at[kept, column]).strip() and str(csv_data.at[dup, column]).strip():
+                    result.at[kept, column] = csv_data.at[dup, column]
+    return result, report
@@ -0,0 +1,286 @@
+# utils/http_client.py
+"""
+Couche HTTP sortante commune : photos des fiches, geo.api.gouv.fr et
+établissements publics.
+
+  - délais de connexion et de lecture sur chaque requête ;
+  - nouvelles tentatives avec attente exponentielle aléatoire (jitter)
+    sur les erreurs 5xx et les erreurs de connexion ;
+  - disjoncteur par hôte, partagé par tout le processus : après plusieurs
+    échecs consécutifs, les appels échouent immédiatement pendant un délai
+    (l'appelant se rabat sur default.jpg ou sur une valeur en cache). Il est
+    consulté avant chaque essai, et l'essai de réouverture n'est jamais répété ;
+  - limiteur de débit optionnel appliqué à chaque essai, nouvelles tentatives comprises ;
+  - échéance globale par traitement : une fois dépassée, plus aucun appel
+    réseau n'est tenté.
+
+Les erreurs levées héritent de requests.exceptions.RequestException, ce qui
+laisse les gestionnaires d'erreurs existants inchangés.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from urllib.parse import urlsplit
+import requests
+
+# Délais (connexion, lecture) en secondes
+DEFAULT_TIMEOUT = (3.05, 10)
+# Nouvelles tentatives après le premier essai, et attente entre deux essais
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# Disjoncteur : nombre d'échecs consécutifs avant ouverture, et durée d'ouverture
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60.0
+# Délai d'un worker gunicorn avant son arrêt forcé (surchargeable via GUNICORN_TIMEOUT)
+DEFAULT_WORKER_TIMEOUT_SECONDS = 600
+# Échéance par défaut d'un traitement (surchargeable via HTTP_JOB_DEADLINE_SECONDS) : le délai
+# du worker moins cette marge, laissée à la génération des DOCX et au ZIP après le dernier appel
+JOB_DEADLINE_MARGIN_SECONDS = 120
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Le disjoncteur de l'hôte est ouvert : la requête n'est pas envoyée."""
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """L'échéance du traitement est dépassée : la requête n'est pas envoyée."""
+
+
+def get_worker_timeout_seconds() -> int:
+    """Retourne le délai des workers gunicorn, lu dans GUNICORN_TIMEOUT si défini."""
+    value = os.environ.get('GUNICORN_TIMEOUT', '')
+    try:
+        return int(value) if value else DEFAULT_WORKER_TIMEOUT_SECONDS
+    except ValueError:
+        logging.warning(f"GUNICORN_TIMEOUT invalide ({value}), utilisation de la valeur par défaut.")
+        return DEFAULT_WORKER_TIMEOUT_SECONDS
+
+
+def get_job_deadline_seconds() -> float:
+    """
+    Retourne l'échéance d'un traitement, lue dans HTTP_JOB_DEADLINE_SECONDS si défini
+    (0 = aucune, accepté seulement si GUNICORN_TIMEOUT vaut 0). Par défaut, et au plus, le délai du worker moins JOB_DEADLINE_MARGIN_SECONDS (la moitié du délai
+    pour un délai court) : le traitement cesse ses appels réseau avant que gunicorn ne tue le worker.
+    """
+    worker_timeout = get_worker_timeout_seconds()
+    limit = max(worker_timeout - JOB_DEADLINE_MARGIN_SECONDS, worker_timeout / 2)
+    value = os.environ.get('HTTP_JOB_DEADLINE_SECONDS', '')
+    try:
+        deadline = float(value) if value else limit
+    except ValueError:
+        logging.warning(f"HTTP_JOB_DEADLINE_SECONDS invalide ({value}), utilisation de la valeur par défaut.")
+        return limit
+    if deadline > limit or (deadline == 0 and worker_timeout > 0):
+        logging.warning(f"HTTP_JOB_DEADLINE_SECONDS ({value}) dépasse le délai du worker gunicorn "
+                        f"({worker_timeout} s), échéance ramenée à {limit} s.")
+        return limit
+    return deadline
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur d'un hôte. Fermé, il laisse passer les requêtes ; ouvert après
+    `threshold` échecs consécutifs, il les refuse pendant `cooldown` secondes,
+    puis laisse passer un essai (semi-ouvert) qui le referme ou le rouvre.
+    """
+
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Indique si une requête peut partir : CLOSED (fermé), HALF_OPEN (essai de réouverture,
+        à ne pas répéter en cas d'échec) ou None (ouvert, requête refusée).
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return self.CLOSED
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Semi-ouvert : un seul essai, les suivants attendent un nouveau délai
+                self.opened_at = time.monotonic()
+                return self.HALF_OPEN
+            return None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> bool:
+        """Enregistre un échec. Retourne True si le disjoncteur vient de s'ouvrir."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                tripped = self.opened_at is None
+                self.opened_at = time.monotonic()
+                return tripped
+            return False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# Dernières réponses réussies des requêtes mises en cache, partagées par le processus
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """Retourne le disjoncteur (partagé par le processus) d'un hôte."""
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+class HttpClient:
+    """
+    Client HTTP d'un traitement : délais, nouvelles tentatives, disjoncteur par hôte,
+    échéance globale et compteurs pour le résumé de fin de traitement.
+    :param timeout: Délais (connexion, lecture) par défaut
+    :param retries: Nombre de nouvelles tentatives après le premier essai
+    :param deadline: Durée maximale du traitement en secondes (None ou 0 = aucune)
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES, deadline: float = None):
+        self.timeout = timeout
+        self.retries = retries
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.stats = {
+            'requests': 0, 'retries': 0, 'failures': 0,
+            'circuit_trips': 0, 'fast_failures': 0, 'cache_hits': 0,
+        }
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        # Une session par thread : requests.Session n'est pas garantie thread-safe
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def remaining(self):
+        """Secondes restantes avant l'échéance, ou None sans échéance."""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def _bounded_timeout(self, timeout, remaining):
+        if remaining is None:
+            return timeout
+        if isinstance(timeout, tuple):
+            return tuple(min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+    def _fallback(self, cache_key, use_cache, error, response=None):
+        with _response_cache_lock:
+            cached = _response_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            self._count('cache_hits')
+            logging.warning(f"{error} : utilisation de la valeur en cache.")
+            return cached
+        if response is not None:
+            return response
+        raise error
+
+    def get(self, url: str, params: dict = None, timeout=None, use_cache: bool = False, rate_limiter=None,
+            **kwargs) -> requests.Response:
+        """
+        Envoie une requête GET.
+        :param url: URL appelée
+        :param params: Paramètres de la requête
+        :param timeout: Délais (connexion, lecture), par défaut ceux du client
+        :param use_cache: Conserver les réponses réussies et les servir si l'hôte est indisponible
+        :param rate_limiter: Limiteur de débit (méthode wait(url)) appelé avant chaque essai
+        :return: La réponse (éventuellement 5xx si toutes les tentatives ont échoué)
+        :raises requests.exceptions.RequestException: connexion impossible, disjoncteur ouvert
+            (CircuitOpenError) ou échéance dépassée (DeadlineExceeded), sans valeur en cache
+        """
+        host = urlsplit(url).netloc
+        breaker = get_breaker(host)
+        cache_key = (url, tuple(sorted((params or {}).items())))
+        timeout = timeout or self.timeout
+
+        response = None
+        error = None
+        for attempt in range(self.retries + 1):
+            # Le disjoncteur a pu s'ouvrir entre deux essais (autres threads du processus)
+            state = breaker.allow()
+            if state is None:
+                if attempt == 0:
+                    self._count('fast_failures')
+                    return self._fallback(cache_key, use_cache, CircuitOpenError(f"Disjoncteur ouvert pour {host}"))
+                error = CircuitOpenError(f"Disjoncteur ouvert pour {host}, nouvelle tentative annulée : {url}")
+                break
+            if rate_limiter is not None:
+                rate_limiter.wait(url)
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                error = DeadlineExceeded(f"Échéance du traitement dépassée, requête non envoyée : {url}")
+                break
+            self._count('requests')
+            try:
+                response = self._session().get(url, params=params,
+                                               timeout=self._bounded_timeout(timeout, remaining), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                response, error = None, e
+            else:
+                if response.status_code < 500:
+                    breaker.record_success()
+                    if use_cache and response.ok:
+                        with _response_cache_lock:
+                            _response_cache[cache_key] = response
+                    return response
+                error = requests.exceptions.HTTPError(f"{response.status_code} pour {url}", response=response)
+
+            if breaker.record_failure():
+                self._count('circuit_trips')
+                logging.warning(f"Disjoncteur ouvert pour {host} après {breaker.failures} échecs consécutifs.")
+                break
+            if state == CircuitBreaker.HALF_OPEN:
+                # Essai de réouverture échoué : le disjoncteur reste ouvert, pas de nouvelle tentative
+                break
+            if attempt < self.retries:
+                self._count('retries')
+                # Attente exponentielle avec jitter complet, bornée par l'échéance
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                remaining = self.remaining()
+                if remaining is not None:
+                    delay = min(delay, max(remaining, 0))
+                time.sleep(delay)
+
+        self._count('failures')
+        return self._fallback(cache_key, use_cache, error, response)
+
+    def summary(self) -> str:
+        """Résumé des compteurs pour le journal de fin de traitement."""
+        s = self.stats
+        return (f"Requêtes HTTP : {s['requests']} envoyées, {s['retries']} nouvelles tentatives, "
+                f"{s['failures']} échecs, {s['circuit_trips']} ouvertures de disjoncteur, "
+                f"{s['fast_failures']} refus immédiats, {s['cache_hits']} valeurs en cache.")
+
+
+_default_client = None
+
+
+def default_client() -> HttpClient:
+    """Client partagé, sans échéance, utilisé quand aucun client de traitement n'est fourni."""
+    global _default_client
+    if _default_client is None:
+        _default_client = HttpClient()
+    return _default_client
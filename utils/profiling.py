@@ -0,0 +1,101 @@
+# utils/profiling.py
+"""
+Profilage optionnel des étapes du traitement (fiches, courriers, fusion, ZIP).
+
+Activé par la variable d'environnement PROFILE_PIPELINE ou le champ "profile"
+du formulaire /process. Chaque étape est mesurée avec cProfile (fonctions les
+plus coûteuses) et tracemalloc (pic mémoire de l'étape, au-delà de la mémoire
+déjà allouée à son début, et pic absolu) ; un rapport texte est produit en
+fin de traitement. Désactivé, stage() retourne un contexte vide partagé : aucun
+coût supplémentaire.
+
+cProfile ne suit que le thread qui l'active : les recherches de communes faites
+par le pool de threads de resolve_communes apparaissent comme du temps d'attente.
+"""
+
+import io
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Nom du rapport dans l'archive ou le dossier du traitement
+REPORT_NAME = 'profil_pipeline.txt'
+# Nombre de fonctions listées par étape
+DEFAULT_TOP = 25
+
+_DISABLED = nullcontext()
+
+
+class PipelineProfiler:
+    """
+    Mesure des étapes du traitement. Une étape appelée plusieurs fois (mode streaming,
+    une fois par commune) cumule ses mesures ; les pics mémoire retenus sont les plus hauts.
+    Le pic propre à l'étape est le pic pendant l'étape moins la mémoire tracée à son début :
+    il ne compte pas ce que les étapes précédentes ont laissé en mémoire.
+    :param enabled: Activer le profilage
+    :param top: Nombre de fonctions listées par étape dans le rapport
+    """
+
+    def __init__(self, enabled: bool = False, top: int = DEFAULT_TOP):
+        self.enabled = enabled
+        self.top = top
+        self._stages = {}
+        self._started_tracemalloc = False
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stage(self, name: str):
+        """Contexte mesurant l'étape `name` (contexte vide si le profilage est désactivé)."""
+        if not self.enabled:
+            return _DISABLED
+        return self._profile_stage(name)
+
+    @contextmanager
+    def _profile_stage(self, name):
+        stage = self._stages.setdefault(
+            name, {'profile': cProfile.Profile(), 'seconds': 0.0, 'calls': 0,
+                   'peak_bytes': 0, 'total_peak_bytes': 0}
+        )
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        stage['profile'].enable()
+        try:
+            yield
+        finally:
+            stage['profile'].disable()
+            stage['seconds'] += time.perf_counter() - start
+            stage['calls'] += 1
+            peak = tracemalloc.get_traced_memory()[1]
+            stage['peak_bytes'] = max(stage['peak_bytes'], peak - baseline)
+            stage['total_peak_bytes'] = max(stage['total_peak_bytes'], peak)
+
+    def report(self) -> str:
+        """Rapport texte : durée, pics mémoire et fonctions les plus coûteuses (temps propre) par étape."""
+        lines = ["Profil du traitement", ""]
+        for name, stage in self._stages.items():
+            lines.append(
+                f"=== {name} : {stage['seconds']:.2f} s, pic mémoire de l'étape {stage['peak_bytes'] / 1024 ** 2:.1f} Mo "
+                f"(pic total {stage['total_peak_bytes'] / 1024 ** 2:.1f} Mo), {stage['calls']} appel(s) ==="
+            )
+            buffer = io.StringIO()
+            stats = pstats.Stats(stage['profile'], stream=buffer)
+            stats.strip_dirs().sort_stats('tottime').print_stats(self.top)
+            # Retirer l'en-tête de pstats, garder le tableau des fonctions
+            table = buffer.getvalue()
+            lines.append(table[table.find('   ncalls'):].rstrip() if '   ncalls' in table else table.strip())
+            lines.append("")
+        return "\n".join(lines)
+
+    def write_report(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+
+    def stop(self) -> None:
+        """Arrête tracemalloc s'il a été démarré par ce profileur."""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
@@ -0,0 +1,134 @@
+# utils/upload.py
+"""
+Réception des fichiers envoyés sur /process et lecture en DataFrame.
+
+Formats acceptés : .csv, .csv.gz, .zip (contenant un .csv ou un .xlsx) et .xlsx.
+Le fichier reçu est écrit par werkzeug, au fil de l'analyse du corps de la requête,
+directement dans le dossier du traitement (UploadRequest), sans copie intermédiaire ;
+la taille maximale est imposée par MAX_CONTENT_LENGTH. Il est ensuite décompressé
+à la volée pendant la lecture par pandas.
+"""
+
+import io
+import os
+import gzip
+import zipfile
+import logging
+import tempfile
+import pandas as pd
+from flask import Request
+
+# Extensions acceptées (l'ordre compte : '.csv.gz' doit être testé avant '.csv')
+ALLOWED_EXTENSIONS = ('.csv.gz', '.csv', '.zip', '.xlsx')
+
+# Taille maximale par défaut d'une requête (1 Go), surchargeable via UPLOAD_MAX_BYTES
+# (0 = aucune limite). Les exports nationaux font plusieurs centaines de Mo en CSV non
+# compressé : la limite par défaut doit les accepter, sous le quota d'un traitement (2 Go)
+DEFAULT_MAX_UPLOAD_BYTES = 1024 * 1024 * 1024
+
+
+class UploadError(Exception):
+    """Fichier reçu invalide : extension non supportée, archive vide ou fichier corrompu."""
+
+
+class UploadRequest(Request):
+    """
+    Requête Flask dont les fichiers envoyés sont écrits directement dans `upload_dir`.
+    Tant que `upload_dir` n'est pas défini (avant le premier accès à request.files),
+    werkzeug garde son comportement habituel (fichier temporaire du système).
+    """
+    upload_dir = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_dir is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        # Fichier nommé et conservé : son chemin (stream.name) est repris par la vue
+        return tempfile.NamedTemporaryFile('w+b', prefix='upload-', dir=self.upload_dir, delete=False)
+
+
+def get_max_upload_bytes():
+    """
+    Retourne la taille maximale d'une requête, lue dans UPLOAD_MAX_BYTES si défini.
+    Retourne None (aucune limite, comme MAX_CONTENT_LENGTH) si UPLOAD_MAX_BYTES vaut 0.
+    """
+    value = os.environ.get('UPLOAD_MAX_BYTES', '')
+    try:
+        max_bytes = int(value) if value else DEFAULT_MAX_UPLOAD_BYTES
+    except ValueError:
+        logging.warning(f"UPLOAD_MAX_BYTES invalide ({value}), utilisation de la valeur par défaut.")
+        return DEFAULT_MAX_UPLOAD_BYTES
+    return max_bytes if max_bytes > 0 else None
+
+
+def detect_extension(filename: str) -> str:
+    """
+    Retourne l'extension reconnue du fichier (ex : '.csv.gz').
+    :param filename: Nom du fichier tel qu'envoyé par le navigateur
+    :return: Extension en minuscules
+    :raises UploadError: si l'extension n'est pas supportée
+    """
+    lower = (filename or '').lower()
+    for ext in ALLOWED_EXTENSIONS:
+        if lower.endswith(ext):
+            return ext
+    raise UploadError(f"Format non supporté : '{filename}'. Formats acceptés : {', '.join(ALLOWED_EXTENSIONS)}")
+
+
+def _read_csv(source) -> pd.DataFrame:
+    return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+
+def _read_excel(source) -> pd.DataFrame:
+    # Les cellules vides d'un classeur sortent en NaN même avec keep_default_na=False
+    data = pd.read_excel(source, dtype=str, keep_default_na=False, engine='openpyxl').fillna('')
+    # Une cellule numérique perd ses zéros de tête (01000 -> "1000") : même correction que load_csv_dataset
+    if 'Code postal' in data.columns:
+        data['Code postal'] = data['Code postal'].str.zfill(5)
+    return data
+
+
+def read_uploaded_table(path: str, extension: str) -> pd.DataFrame:
+    """
+    Lit le fichier reçu et retourne un DataFrame de chaînes (dtype=str, keep_default_na=False).
+    Les fichiers compressés sont décompressés pendant la lecture, sans copie intermédiaire.
+    :param path: Chemin du fichier enregistré
+    :param extension: Extension retournée par detect_extension
+    :return: DataFrame des données
+    :raises UploadError: si le fichier est corrompu ou illisible
+    """
+    try:
+        return _read_uploaded_table(path, extension)
+    except UploadError:
+        raise
+    except (zipfile.BadZipFile, gzip.BadGzipFile, EOFError, OSError, UnicodeDecodeError,
+            pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise UploadError(f"Fichier illisible ou corrompu : {e}") from e
+
+
+def _read_uploaded_table(path: str, extension: str) -> pd.DataFrame:
+    if extension == '.csv':
+        return _read_csv(path)
+    if extension == '.csv.gz':
+        return pd.read_csv(path, dtype=str, keep_default_na=False, compression='gzip')
+    if extension == '.xlsx':
+        return _read_excel(path)
+    if extension == '.zip':
+        with zipfile.ZipFile(path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir()
+                and not info.filename.startswith('__MACOSX/')
+                and not os.path.basename(info.filename).startswith('.')
+                and info.filename.lower().endswith(('.csv', '.xlsx'))
+            ]
+            if not members:
+                raise UploadError("L'archive ZIP ne contient aucun fichier .csv ou .xlsx.")
+            if len(members) > 1:
+                logging.warning(f"Plusieurs fichiers dans l'archive, seul '{members[0].filename}' est lu.")
+            member = members[0]
+            with archive.open(member) as f:
+                if member.filename.lower().endswith('.csv'):
+                    return _read_csv(f)
+                # openpyxl a besoin d'un fichier adressable : le membre est lu en mémoire
+                return _read_excel(io.BytesIO(f.read()))
+    raise UploadError(f"Format non supporté : '{extension}'.")
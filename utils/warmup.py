@@ -0,0 +1,141 @@
+# utils/warmup.py
+"""
+Préchauffage du service avant le fork des workers gunicorn.
+
+warm_up() importe les bibliothèques lourdes, lit les modèles DOCX et charge
+les données de référence une seule fois. Avec preload_app (gunicorn.conf.py),
+cela se fait dans le processus maître : les workers partagent ensuite ces pages
+mémoire en copie sur écriture au lieu de tout recharger à la première requête.
+La durée du préchauffage et la mémoire avant/après sont journalisées et exposées
+par /healthz. La RSS compte en entier les pages partagées avec le maître : la
+mémoire réellement due à un processus est sa PSS (pages partagées divisées par le
+nombre de processus qui les partagent) et ses pages privées, lues dans
+/proc/self/smaps_rollup.
+"""
+
+import io
+import os
+import time
+import logging
+import importlib
+import threading
+
+# Bibliothèques importées par main.py et les modules utils
+HEAVY_MODULES = (
+    'pandas', 'docxtpl', 'docx', 'docxcompose.composer', 'PIL.Image',
+    'bs4', 'lxml.etree', 'openpyxl', 'requests',
+)
+
+# Modèles DOCX utilisés par les fiches et les courriers
+TEMPLATE_FILES = ('fichev1.docx', 'modele_lettre_infraction.docx')
+
+_template_bytes = {}
+_template_lock = threading.Lock()
+_state = {'ready': False}
+
+
+def memory_kb() -> dict:
+    """
+    Mémoire actuelle du processus en Ko, lue dans /proc/self/smaps_rollup (Linux >= 4.14) :
+    rss, pss (part proportionnelle des pages partagées), private (Private_Clean + Private_Dirty)
+    et shared (Shared_Clean + Shared_Dirty). Dictionnaire vide si indisponible.
+    """
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup', encoding='ascii') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[name] = int(value.split()[0])
+    except (OSError, ValueError):
+        return {}
+    return {
+        'rss': fields.get('Rss'),
+        'pss': fields.get('Pss'),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+    }
+
+
+def format_memory(measures: dict) -> str:
+    """Résumé lisible de memory_kb() pour les journaux."""
+    if not measures:
+        return "mémoire indisponible"
+    return (f"PSS {measures['pss']} Ko, privée {measures['private']} Ko, "
+            f"partagée {measures['shared']} Ko, RSS {measures['rss']} Ko")
+
+
+def file_cache_key(path: str) -> tuple:
+    """
+    Clé de cache d'un fichier : nom, taille et date de modification.
+    Les copies de utils faites par /process (copytree préserve les dates) partagent ainsi le même cache.
+    """
+    stat = os.stat(path)
+    return os.path.basename(path), stat.st_size, stat.st_mtime_ns
+
+
+def load_template_bytes(path: str) -> bytes:
+    """Retourne le contenu d'un modèle DOCX, lu une seule fois sur le disque."""
+    key = file_cache_key(path)
+    with _template_lock:
+        if key not in _template_bytes:
+            with open(path, 'rb') as f:
+                _template_bytes[key] = f.read()
+        return _template_bytes[key]
+
+
+def load_template(path: str):
+    """
+    Retourne un nouveau DocxTemplate construit depuis le modèle en mémoire.
+    Un objet neuf est nécessaire à chaque document : render() modifie le modèle.
+    """
+    from docxtpl import DocxTemplate
+    return DocxTemplate(io.BytesIO(load_template_bytes(path)))
+
+
+def warm_up(utils_dir: str) -> dict:
+    """
+    Importe les bibliothèques lourdes, charge les modèles et les données de référence.
+    :param utils_dir: Dossier utils contenant les modèles et departements-region.csv
+    :return: Mesures du préchauffage (durée, mémoire avant/après)
+    """
+    if _state['ready']:
+        return status()
+    start = time.perf_counter()
+    memory_before = memory_kb()
+
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logging.warning(f"Préchauffage : import de {name} impossible ({e})")
+
+    for name in TEMPLATE_FILES:
+        path = os.path.join(utils_dir, name)
+        if os.path.isfile(path):
+            # Une première analyse charge aussi les classes python-docx / lxml
+            load_template(path).get_docx()
+        else:
+            logging.warning(f"Préchauffage : modèle introuvable {path}")
+
+    # Import tardif : main importe ce module
+    from main import load_department_mapping
+    load_department_mapping(utils_dir)
+
+    _state.update(
+        ready=True,
+        pid=os.getpid(),
+        duration_seconds=round(time.perf_counter() - start, 3),
+        memory_before_kb=memory_before,
+        memory_after_kb=memory_kb(),
+    )
+    logging.info(
+        f"Préchauffage terminé en {_state['duration_seconds']} s "
+        f"(avant : {format_memory(memory_before)} ; après : {format_memory(_state['memory_after_kb'])})"
+    )
+    return status()
+
+
+def status() -> dict:
+    """Mesures du préchauffage et mémoire actuelle du processus, pour /healthz."""
+    return dict(_state, current_pid=os.getpid(), current_memory_kb=memory_kb())
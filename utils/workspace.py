@@ -0,0 +1,275 @@
+# utils/workspace.py
+"""
+Gestion du cycle de vie des dossiers de travail des traitements (/process).
+
+Chaque traitement reçoit un dossier sous WORKSPACE_ROOT, marqué par un fichier
+.job.json (pid du worker, hôte, instance du service, date de création). La date de
+modification du marqueur sert de date de dernière activité. L'état est lu sur le
+disque, ce qui le rend commun à tous les workers gunicorn :
+  - quota par traitement et quota global en octets, vérifiés pendant le traitement ;
+  - suppression dès l'envoi du ZIP commencé, en cas d'erreur, ou après TTL sans activité ;
+  - nettoyage au démarrage des dossiers laissés par un worker arrêté brutalement
+    ou par une exécution précédente du service (redémarrage du conteneur).
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import logging
+import tempfile
+
+# Fichier marqueur déposé dans chaque dossier de travail
+JOB_MARKER = '.job.json'
+
+# Valeurs par défaut, surchargeables par variables d'environnement
+DEFAULT_WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), 'fiches_jobs')
+DEFAULT_JOB_QUOTA_BYTES = 2 * 1024 ** 3      # 2 Go par traitement
+DEFAULT_TOTAL_QUOTA_BYTES = 10 * 1024 ** 3   # 10 Go pour l'ensemble des traitements
+DEFAULT_TTL_SECONDS = 3600                   # 1 heure sans activité
+# Intervalle minimal entre deux mesures du disque par quota_checker (secondes)
+QUOTA_CHECK_INTERVAL = 1.0
+
+
+class WorkspaceQuotaExceeded(Exception):
+    """Le quota disque d'un traitement ou le quota global est dépassé."""
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name, '')
+    try:
+        return int(value) if value else default
+    except ValueError:
+        logging.warning(f"{name} invalide ({value}), utilisation de la valeur par défaut.")
+        return default
+
+
+def directory_size(path: str) -> int:
+    """Retourne la taille totale en octets des fichiers d'un dossier."""
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, file))
+            except OSError:
+                # Fichier supprimé entre-temps
+                pass
+    return total
+
+
+def instance_id() -> str:
+    """
+    Identifiant de l'exécution courante du service : boot du noyau et date de démarrage
+    du processus 1 de l'espace de PID. Il change à chaque redémarrage de la machine ou du
+    conteneur, mais il est le même pour le maître gunicorn et tous ses workers.
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id', encoding='ascii') as f:
+            boot_id = f.read().strip()
+        with open('/proc/1/stat', encoding='ascii') as f:
+            # Le 22e champ est la date de démarrage ; le nom du processus (2e champ) peut contenir des espaces
+            pid1_start = f.read().rsplit(')', 1)[1].split()[19]
+        return f"{boot_id}:{pid1_start}"
+    except (OSError, IndexError):
+        # Hors Linux : identifiant du processus qui importe ce module (le maître avec preload_app)
+        return _FALLBACK_INSTANCE_ID
+
+
+_FALLBACK_INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{time.time()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WorkspaceManager:
+    """
+    Crée, mesure et supprime les dossiers de travail des traitements.
+    :param root: Dossier parent des dossiers de travail
+    :param job_quota: Taille maximale d'un dossier de travail (octets)
+    :param total_quota: Taille maximale de l'ensemble des dossiers (octets)
+    :param ttl: Durée de vie maximale d'un dossier (secondes)
+    """
+
+    def __init__(self, root: str = None, job_quota: int = None, total_quota: int = None, ttl: int = None):
+        self.root = root or os.environ.get('WORKSPACE_ROOT') or DEFAULT_WORKSPACE_ROOT
+        self.job_quota = job_quota or _env_int('WORKSPACE_JOB_QUOTA_BYTES', DEFAULT_JOB_QUOTA_BYTES)
+        self.total_quota = total_quota or _env_int('WORKSPACE_TOTAL_QUOTA_BYTES', DEFAULT_TOTAL_QUOTA_BYTES)
+        self.ttl = ttl or _env_int('WORKSPACE_TTL_SECONDS', DEFAULT_TTL_SECONDS)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def _read_marker(self, job_id: str) -> dict:
+        try:
+            with open(os.path.join(self.path(job_id), JOB_MARKER), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def jobs(self) -> list:
+        """Retourne les identifiants des dossiers de travail présents sur le disque."""
+        try:
+            return [name for name in os.listdir(self.root) if os.path.isdir(self.path(name))]
+        except FileNotFoundError:
+            return []
+
+    def usage(self, job_id: str = None) -> int:
+        """Taille en octets d'un dossier de travail, ou de l'ensemble si job_id est omis."""
+        if job_id is not None:
+            return directory_size(self.path(job_id))
+        return sum(directory_size(self.path(name)) for name in self.jobs())
+
+    def create(self):
+        """
+        Crée un nouveau dossier de travail après avoir supprimé les dossiers expirés.
+        :return: (job_id, chemin du dossier)
+        :raises WorkspaceQuotaExceeded: si le quota global est déjà atteint
+        """
+        self.cleanup_expired()
+        total = self.usage()
+        if total >= self.total_quota:
+            raise WorkspaceQuotaExceeded(
+                f"Espace disque insuffisant : {total} octets utilisés (quota global {self.total_quota} octets)."
+            )
+        job_id = uuid.uuid4().hex
+        job_dir = self.path(job_id)
+        os.makedirs(job_dir)
+        marker = {'pid': os.getpid(), 'host': socket.gethostname(), 'instance': instance_id(),
+                  'created': time.time()}
+        with open(os.path.join(job_dir, JOB_MARKER), 'w', encoding='utf-8') as f:
+            json.dump(marker, f)
+        logging.info(f"Dossier de travail créé : {job_dir}")
+        return job_id, job_dir
+
+    def touch(self, job_id: str) -> None:
+        """Enregistre une activité du traitement (repousse son expiration)."""
+        try:
+            os.utime(os.path.join(self.path(job_id), JOB_MARKER))
+        except OSError:
+            pass
+
+    def last_activity(self, job_id: str):
+        """Date de dernière activité d'un dossier de travail (timestamp), None s'il n'existe plus."""
+        for path in (os.path.join(self.path(job_id), JOB_MARKER), self.path(job_id)):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                continue
+        return None
+
+    def check_quota(self, job_id: str) -> int:
+        """
+        Vérifie le quota du traitement et le quota global, et enregistre une activité.
+        :return: Taille actuelle du dossier de travail
+        :raises WorkspaceQuotaExceeded: si l'un des quotas est dépassé
+        """
+        self.touch(job_id)
+        size = self.usage(job_id)
+        if size > self.job_quota:
+            raise WorkspaceQuotaExceeded(
+                f"Quota du traitement dépassé : {size} octets (limite {self.job_quota} octets)."
+            )
+        total = self.usage()
+        if total > self.total_quota:
+            raise WorkspaceQuotaExceeded(
+                f"Quota global dépassé : {total} octets (limite {self.total_quota} octets)."
+            )
+        return size
+
+    def quota_checker(self, job_id: str, interval: float = QUOTA_CHECK_INTERVAL):
+        """
+        Retourne une fonction sans argument à appeler après chaque écriture (photo, fiche,
+        commune...). Elle vérifie les quotas au plus une fois par `interval` secondes,
+        pour que la mesure du disque reste bon marché, et lève WorkspaceQuotaExceeded dès
+        qu'un quota est dépassé.
+        """
+        last_check = [float('-inf')]
+
+        def check():
+            now = time.monotonic()
+            if now - last_check[0] >= interval:
+                last_check[0] = now
+                self.check_quota(job_id)
+        return check
+
+    def release(self, job_id: str) -> None:
+        """Supprime un dossier de travail (au début de l'envoi du ZIP ou en cas d'erreur)."""
+        job_dir = self.path(job_id)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        logging.info(f"Dossier de travail supprimé : {job_dir}")
+
+    def cleanup_expired(self) -> list:
+        """
+        Supprime les dossiers de travail sans activité depuis plus que le TTL.
+        Un traitement en cours enregistre une activité à chaque vérification de quota,
+        et l'envoi du ZIP aussi : il n'est donc pas supprimé tant qu'il avance.
+        Retourne les identifiants supprimés.
+        """
+        now = time.time()
+        removed = []
+        for job_id in self.jobs():
+            last_activity = self.last_activity(job_id)
+            if last_activity is not None and now - last_activity > self.ttl:
+                self.release(job_id)
+                removed.append(job_id)
+        return removed
+
+    def cleanup_orphans(self) -> list:
+        """
+        Supprime les dossiers de travail laissés par une exécution précédente du service
+        (autre instance : redémarrage de la machine ou du conteneur, où les PID repartent de 1)
+        ou par un worker de l'instance courante qui n'existe plus (arrêt brutal),
+        ainsi que les dossiers expirés. À appeler au démarrage du service.
+        """
+        host = socket.gethostname()
+        current_instance = instance_id()
+        removed = []
+        for job_id in self.jobs():
+            marker = self._read_marker(job_id)
+            pid = marker.get('pid')
+            # Un dossier sans marqueur peut être en cours de création, et un dossier d'un autre
+            # hôte (WORKSPACE_ROOT partagé) ne peut pas être vérifié : ils expireront via le TTL
+            if not marker or marker.get('host') != host:
+                continue
+            if marker.get('instance') != current_instance or (pid and not _pid_alive(pid)):
+                self.release(job_id)
+                removed.append(job_id)
+        removed += self.cleanup_expired()
+        if removed:
+            logging.warning(f"{len(removed)} dossier(s) de travail orphelin(s) ou expiré(s) supprimé(s).")
+        return removed
+
+    def status(self) -> dict:
+        """Retourne l'occupation disque actuelle, par traitement et au total."""
+        now = time.time()
+        jobs = []
+        for job_id in self.jobs():
+            marker = self._read_marker(job_id)
+            created = marker.get('created')
+            last_activity = self.last_activity(job_id)
+            jobs.append({
+                'job_id': job_id,
+                'size_bytes': self.usage(job_id),
+                'age_seconds': round(now - created) if created else None,
+                'idle_seconds': round(now - last_activity) if last_activity else None,
+                'pid': marker.get('pid'),
+            })
+        return {
+            'root': self.root,
+            'jobs': jobs,
+            'job_count': len(jobs),
+            'total_bytes': sum(job['size_bytes'] for job in jobs),
+            'job_quota_bytes': self.job_quota,
+            'total_quota_bytes': self.total_quota,
+            'ttl_seconds': self.ttl,
+        }